@@ -1,7 +1,115 @@
+import asyncio
+import hashlib
+import json
+import threading
+import weakref
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
 from dataclasses import dataclass
-from typing import Any, Dict, List
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, Union
 
-from anthropic import Anthropic
+import httpx
+from anthropic import Anthropic, AsyncAnthropic, DefaultAsyncHttpxClient
+
+from semantic_cache import SemanticCache
+
+# Instructions for answering several independent prompts in one request
+BATCH_PROMPT_PREFIX = """Answer each of the numbered prompts below independently.
+Return only a JSON array of strings, containing one answer per prompt in the same order.
+
+"""
+
+# The API accepts at most this many cache_control breakpoints per request
+MAX_CACHE_BREAKPOINTS = 4
+
+# A prompt is either plain text or a list of Anthropic text content blocks
+Prompt = Union[str, List[Dict[str, Any]]]
+
+
+def cached_prompt(prefix: str, dynamic: str) -> Prompt:
+    """Build a prompt whose static prefix is marked as a cache breakpoint"""
+    # Empty text blocks are rejected by the API
+    if not prefix:
+        return dynamic
+    blocks = [
+        {"type": "text", "text": prefix, "cache_control": {"type": "ephemeral"}}
+    ]
+    if dynamic:
+        blocks.append({"type": "text", "text": dynamic})
+    return blocks
+
+
+def prompt_text(prompt: Prompt) -> str:
+    """Flatten a prompt to plain text"""
+    if isinstance(prompt, str):
+        return prompt
+    return "".join(block["text"] for block in prompt)
+
+
+def limit_cache_breakpoints(prompt: Prompt, available: int) -> Prompt:
+    """Drop the earliest cache_control markers beyond the available number"""
+    if isinstance(prompt, str):
+        return prompt
+    marked = [i for i, block in enumerate(prompt) if "cache_control" in block]
+    dropped = set(marked[: max(len(marked) - available, 0)])
+    if not dropped:
+        return prompt
+    # Later breakpoints cover longer prefixes, so they are the ones to keep
+    return [
+        {k: v for k, v in block.items() if k != "cache_control"}
+        if i in dropped
+        else block
+        for i, block in enumerate(prompt)
+    ]
+
+
+def strip_code_fence(text: str) -> str:
+    """Remove a surrounding markdown code fence (e.g. ```json) from LLM output"""
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+        if text.rstrip().endswith("```"):
+            text = text.rstrip()[:-3]
+    return text.strip()
+
+
+def split_prompt(prompt: Prompt) -> Tuple[str, str]:
+    """Split a prompt into its cache-marked static text and its dynamic text"""
+    if isinstance(prompt, str):
+        return "", prompt
+    static = "".join(block["text"] for block in prompt if "cache_control" in block)
+    dynamic = "".join(block["text"] for block in prompt if "cache_control" not in block)
+    return static, dynamic
+
+
+@asynccontextmanager
+async def task_group() -> AsyncIterator[asyncio.TaskGroup]:
+    """An asyncio.TaskGroup that raises its first failure, not an ExceptionGroup"""
+    try:
+        async with asyncio.TaskGroup() as group:
+            yield group
+    except ExceptionGroup as e:
+        # The group has cancelled the other tasks; surface the failure itself
+        raise e.exceptions[0]
+
+
+def _create_http_client() -> httpx.AsyncClient:
+    """Create a pooled async HTTP client for one event loop"""
+    limits = httpx.Limits(max_keepalive_connections=50, max_connections=200)
+    try:
+        # HTTP/2 multiplexes concurrent requests over one TLS session
+        return DefaultAsyncHttpxClient(http2=True, limits=limits)
+    except ImportError:
+        # HTTP/2 needs the optional h2 package (pip install "httpx[http2]")
+        return DefaultAsyncHttpxClient(limits=limits)
+
+
+@dataclass
+class _InflightRequest:
+    """A request shared by every concurrent caller that sent the same prompt"""
+
+    task: asyncio.Task
+    waiters: int = 0
 
 
 @dataclass
@@ -12,45 +120,384 @@ class Tool:
 
 
 class AugmentedLLM:
-    def __init__(self, api_key: str):
+    def __init__(
+        self,
+        api_key: str,
+        model: str = "claude-3-sonnet-20240229",
+        cache_size: int = 512,
+        semantic_cache: Optional[SemanticCache] = None,
+        max_output_tokens: int = 4096,
+    ):
+        # The async clients serve the asyncio workflows; the sync one serves the rest
         self.client = Anthropic(api_key=api_key)
+        self._api_key = api_key
+        # Pooled connections belong to the loop that opened them, so each running
+        # event loop gets its own async client, created on first use
+        self._aclients: weakref.WeakKeyDictionary[
+            asyncio.AbstractEventLoop, AsyncAnthropic
+        ] = weakref.WeakKeyDictionary()
+        self.model = model
+        # Most output tokens the model accepts in one request
+        self.max_output_tokens = max_output_tokens
         self.tools: List[Tool] = []
-        self.memory: List[Dict] = []
+        self._tool_descriptions: Optional[str] = None
+        # Only the last 5 exchanges are ever used, pre-formatted for the prompt
+        self.memory: deque[str] = deque(maxlen=5)
+        # LRU cache of responses keyed by a hash of the model, tools and prompt
+        self._cache: OrderedDict[str, str] = OrderedDict()
+        self._cache_size = cache_size
+        self._cache_lock = threading.Lock()
+        # Requests currently awaiting a response, by cache key
+        self._inflight: Dict[str, _InflightRequest] = {}
+        # Optional similarity-based cache consulted after the exact-match cache
+        self.semantic_cache = semantic_cache
 
     def add_tool(self, tool: Tool):
         """Register a new tool with the LLM"""
         self.tools.append(tool)
+        self._tool_descriptions = None
 
     def get_tool_descriptions(self) -> str:
         """Format tool descriptions for the prompt"""
-        descriptions = []
-        for tool in self.tools:
-            desc = f"Tool: {tool.name}\nDescription: {tool.description}\n"
-            desc += f"Parameters: {tool.parameters}\n"
-            descriptions.append(desc)
-        return "\n".join(descriptions)
-
-    def call(self, prompt: str) -> str:
-        """Make an augmented call to the LLM"""
-        # Add tools and memory context to the prompt
-        context = f"""Available tools:\n{self.get_tool_descriptions()}\n\n"""
-        if self.memory:
-            context += "Previous context:\n"
-            for item in self.memory[-5:]:  # Last 5 memory items
-                context += f"{item}\n"
-
-        full_prompt = context + prompt
-
-        response = self.client.messages.create(
-            model="claude-3-sonnet-20240229",
-            max_tokens=1000,
-            messages=[{"role": "user", "content": full_prompt}],
-        )
+        # Built once per tool set, sorted by name so the text is byte-stable
+        if self._tool_descriptions is None:
+            self._tool_descriptions = "\n".join(
+                f"Tool: {tool.name}\nDescription: {tool.description}\n"
+                f"Parameters: {tool.parameters}\n"
+                for tool in sorted(self.tools, key=lambda tool: tool.name)
+            )
+        return self._tool_descriptions
+
+    def get_system_blocks(self) -> List[Dict[str, Any]]:
+        """Build the system prompt as cacheable content blocks"""
+        # Tool descriptions rarely change, so they form the stable cache prefix
+        return [
+            {
+                "type": "text",
+                "text": f"Available tools:\n{self.get_tool_descriptions()}",
+                "cache_control": {"type": "ephemeral"},
+            }
+        ]
+
+    def _with_memory(self, prompt: Prompt) -> Prompt:
+        """Insert the memory context after the prompt's instruction prefix"""
+        if not self.memory:
+            return prompt
+        # Memory shifts after every call, so it goes after the first cache
+        # breakpoint (the instructions) and is never marked itself; the tags
+        # keep it apart from the text that follows
+        memory = {
+            "type": "text",
+            "text": "<previous_context>\n"
+            + "\n".join(self.memory)
+            + "\n</previous_context>\n\n",
+        }
+        if isinstance(prompt, str):
+            return [memory, {"type": "text", "text": prompt}]
+        marked = [i for i, block in enumerate(prompt) if "cache_control" in block]
+        split = marked[0] + 1 if marked else 0
+        return [*prompt[:split], memory, *prompt[split:]]
+
+    def _cache_key(
+        self, prompt: Prompt, max_tokens: int, stop_sequences: Optional[List[str]]
+    ) -> str:
+        """Hash the model, output limits, tools and prompt into a response cache key"""
+        # Memory is left out: it shifts on every call, so no repeat would ever hit
+        full_prompt = self.get_tool_descriptions() + prompt_text(prompt)
+        return hashlib.blake2b(
+            f"{self.model}:{max_tokens}:{stop_sequences}:{full_prompt}".encode(),
+            digest_size=16,
+        ).hexdigest()
+
+    def _cache_get(self, key: str) -> Optional[str]:
+        """Look up a cached response, marking it as recently used"""
+        with self._cache_lock:
+            if key not in self._cache:
+                return None
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+    def _cache_put(self, key: str, text: str):
+        """Store a response, evicting the least recently used entry if full"""
+        with self._cache_lock:
+            self._cache[key] = text
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+
+    @property
+    def aclient(self) -> AsyncAnthropic:
+        """The async client for the running event loop, shared by all its calls"""
+        loop = asyncio.get_running_loop()
+        aclient = self._aclients.get(loop)
+        if aclient is None:
+            aclient = AsyncAnthropic(
+                api_key=self._api_key, http_client=_create_http_client()
+            )
+            self._aclients[loop] = aclient
+        return aclient
+
+    async def aclose(self):
+        """Close this instance's async client for the running event loop"""
+        aclient = self._aclients.pop(asyncio.get_running_loop(), None)
+        if aclient is not None:
+            await aclient.close()
+
+    def _semantic_key(self, prompt: Prompt) -> Tuple[str, str]:
+        """Return the semantic cache namespace and the text to embed"""
+        static, dynamic = split_prompt(prompt)
+        return self.model + self.get_tool_descriptions() + static, dynamic
+
+    def _lookup(
+        self, prompt: Prompt, key: str, use_cache: bool, semantic: bool
+    ) -> Optional[str]:
+        """Return a cached response for the prompt, if there is one"""
+        if not use_cache:
+            return None
+        cached = self._cache_get(key)
+        if cached is None and semantic:
+            namespace, dynamic = self._semantic_key(prompt)
+            cached = self.semantic_cache.lookup(dynamic, namespace)
+            if cached is not None:
+                self._cache_put(key, cached)
+        return cached
+
+    def _record(
+        self, prompt: Prompt, key: str, text: str, use_cache: bool, semantic: bool
+    ) -> str:
+        """Cache a fresh response and add it to memory"""
+        if use_cache:
+            self._cache_put(key, text)
+        if semantic:
+            namespace, dynamic = self._semantic_key(prompt)
+            self.semantic_cache.update(dynamic, text, namespace)
 
         # Store response in memory
-        self.memory.append({"prompt": prompt, "response": response.content[0].text})
+        self.memory.append(f"prompt: {prompt_text(prompt)}\nresponse: {text}")
+
+        return text
+
+    def _request(
+        self, prompt: Prompt, max_tokens: int, stop_sequences: Optional[List[str]]
+    ) -> Dict[str, Any]:
+        """Build the messages.create arguments for a prompt"""
+        # Tools go in the system prompt; memory joins the prompt in the message
+        system = self.get_system_blocks()
+        content = limit_cache_breakpoints(
+            self._with_memory(prompt), MAX_CACHE_BREAKPOINTS - len(system)
+        )
+        request = {
+            "model": self.model,
+            "max_tokens": min(max_tokens, self.max_output_tokens),
+            "system": system,
+            "messages": [{"role": "user", "content": content}],
+        }
+        if stop_sequences:
+            request["stop_sequences"] = stop_sequences
+        return request
+
+    def call(
+        self,
+        prompt: Prompt,
+        use_cache: bool = True,
+        use_semantic_cache: bool = False,
+        max_tokens: int = 1000,
+        stop_sequences: Optional[List[str]] = None,
+    ) -> str:
+        """Make an augmented call to the LLM
+
+        max_tokens and stop_sequences bound the output, so each workflow
+        phase can pick its own budget. Identical prompts are answered from
+        an in-process cache; pass use_cache=False where fresh samples are
+        needed (e.g. voting).
+        With use_semantic_cache=True, prompts whose dynamic part is similar
+        to a previous one under the same static prefix are also answered
+        from the semantic cache, if one is configured.
+        """
+        key = self._cache_key(prompt, max_tokens, stop_sequences)
+        semantic = bool(use_cache and use_semantic_cache and self.semantic_cache)
+        # Cache hits are not added to memory to avoid duplicate history
+        cached = self._lookup(prompt, key, use_cache, semantic)
+        if cached is not None:
+            return cached
+
+        request = self._request(prompt, max_tokens, stop_sequences)
+        response = self.client.messages.create(**request)
+        return self._record(prompt, key, response.content[0].text, use_cache, semantic)
+
+    async def acall(
+        self,
+        prompt: Prompt,
+        use_cache: bool = True,
+        use_semantic_cache: bool = False,
+        max_tokens: int = 1000,
+        stop_sequences: Optional[List[str]] = None,
+        dedupe: bool = True,
+    ) -> str:
+        """Make an augmented call to the LLM without blocking the event loop
+
+        With dedupe=True, concurrent calls with an identical request share
+        a single in-flight response; pass dedupe=False where independent
+        samples are needed (e.g. voting).
+        """
+        key = self._cache_key(prompt, max_tokens, stop_sequences)
+        semantic = bool(use_cache and use_semantic_cache and self.semantic_cache)
+        cached = self._lookup(prompt, key, use_cache, semantic)
+        if cached is not None:
+            return cached
+
+        if not dedupe:
+            return await self._acall_uncached(
+                prompt, key, max_tokens, stop_sequences, use_cache, semantic
+            )
+
+        # The request runs as its own task that no single caller owns
+        inflight = self._inflight.get(key)
+        if inflight is None:
+            inflight = _InflightRequest(
+                asyncio.create_task(
+                    self._acall_uncached(
+                        prompt, key, max_tokens, stop_sequences, use_cache, semantic
+                    )
+                )
+            )
+            self._inflight[key] = inflight
+            inflight.task.add_done_callback(
+                lambda task: self._forget_inflight(key, inflight)
+            )
+
+        inflight.waiters += 1
+        try:
+            # Shielded so a cancelled waiter leaves the request running for the rest
+            return await asyncio.shield(inflight.task)
+        finally:
+            inflight.waiters -= 1
+            if inflight.waiters == 0 and not inflight.task.done():
+                # Every waiter has gone, so nobody needs the response any more
+                inflight.task.cancel()
+
+    def _forget_inflight(self, key: str, inflight: "_InflightRequest"):
+        """Drop a finished request from the in-flight map"""
+        if self._inflight.get(key) is inflight:
+            del self._inflight[key]
+        # Mark any exception as retrieved, in case every waiter was cancelled
+        if not inflight.task.cancelled():
+            inflight.task.exception()
+
+    async def _acall_uncached(
+        self,
+        prompt: Prompt,
+        key: str,
+        max_tokens: int,
+        stop_sequences: Optional[List[str]],
+        use_cache: bool,
+        semantic: bool,
+    ) -> str:
+        """Send a request with the async client and record the response"""
+        request = self._request(prompt, max_tokens, stop_sequences)
+        response = await self.aclient.messages.create(**request)
+        return self._record(prompt, key, response.content[0].text, use_cache, semantic)
+
+    async def astream_call(
+        self,
+        prompt: Prompt,
+        use_cache: bool = True,
+        use_semantic_cache: bool = False,
+        max_tokens: int = 1000,
+        stop_sequences: Optional[List[str]] = None,
+    ) -> AsyncIterator[str]:
+        """Stream an augmented call to the LLM as text deltas
+
+        Consumers may stop early to cancel the generation (close the
+        generator, e.g. with contextlib.aclosing); the response is only
+        cached and added to memory if the stream is read to the end.
+        A cached response, exact or semantic, is yielded as a single delta.
+        """
+        key = self._cache_key(prompt, max_tokens, stop_sequences)
+        semantic = bool(use_cache and use_semantic_cache and self.semantic_cache)
+        cached = self._lookup(prompt, key, use_cache, semantic)
+        if cached is not None:
+            yield cached
+            return
+
+        chunks = []
+        request = self._request(prompt, max_tokens, stop_sequences)
+        async with self.aclient.messages.stream(**request) as stream:
+            async for text in stream.text_stream:
+                chunks.append(text)
+                yield text
+        self._record(prompt, key, "".join(chunks), use_cache, semantic)
+
+    async def acall_batched(
+        self,
+        prompts: List[str],
+        use_cache: bool = True,
+        max_tokens: int = 1000,
+        dedupe: bool = True,
+    ) -> List[str]:
+        """Answer several prompts with a single LLM request
+
+        max_tokens is the budget per answer; the batched request gets the
+        sum of them, so prompts are split across as many requests as needed
+        to keep each within the model's output limit.
+        """
+        per_request = max(self.max_output_tokens // max_tokens, 1)
+        if len(prompts) > per_request:
+            batches = await asyncio.gather(
+                *(
+                    self.acall_batched(
+                        prompts[i : i + per_request],
+                        use_cache=use_cache,
+                        max_tokens=max_tokens,
+                        dedupe=dedupe,
+                    )
+                    for i in range(0, len(prompts), per_request)
+                )
+            )
+            return [answer for batch in batches for answer in batch]
+
+        if len(prompts) == 1:
+            return [
+                await self.acall(
+                    prompts[0],
+                    use_cache=use_cache,
+                    max_tokens=max_tokens,
+                    dedupe=dedupe,
+                )
+            ]
+
+        numbered = "Prompts:\n" + "\n\n".join(
+            f"{i}. {prompt}" for i, prompt in enumerate(prompts, start=1)
+        )
+        response = await self.acall(
+            cached_prompt(BATCH_PROMPT_PREFIX, numbered),
+            use_cache=use_cache,
+            max_tokens=max_tokens * len(prompts),
+            dedupe=dedupe,
+        )
+        try:
+            answers = json.loads(strip_code_fence(response))
+        except json.JSONDecodeError:
+            answers = None
 
-        return response.content[0].text
+        if not isinstance(answers, list) or len(answers) != len(prompts):
+            # Fall back to one request per prompt rather than mis-assign answers
+            return list(
+                await asyncio.gather(
+                    *(
+                        self.acall(
+                            prompt,
+                            use_cache=use_cache,
+                            max_tokens=max_tokens,
+                            dedupe=dedupe,
+                        )
+                        for prompt in prompts
+                    )
+                )
+            )
+        return [
+            answer if isinstance(answer, str) else json.dumps(answer)
+            for answer in answers
+        ]
 
 
 # Example usage
@@ -0,0 +1,101 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+# Optional dependencies: pip install faiss-cpu sentence-transformers
+try:
+    import faiss
+    import numpy as np
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    faiss = None
+    np = None
+    SentenceTransformer = None
+
+
+class SemanticCache:
+    """Cache LLM responses by prompt similarity, so paraphrases hit too"""
+
+    def __init__(
+        self,
+        model_name: str = "all-MiniLM-L6-v2",
+        similarity_threshold: float = 0.92,
+        ttl: Optional[float] = 3600,
+        max_candidates: int = 4,
+        max_entries: Optional[int] = 10_000,
+    ):
+        if faiss is None or SentenceTransformer is None:
+            raise ImportError(
+                "SemanticCache requires the faiss-cpu and sentence-transformers packages"
+            )
+        self.encoder = SentenceTransformer(model_name)
+        self.similarity_threshold = similarity_threshold
+        self.ttl = ttl
+        self.max_candidates = max_candidates
+        self.max_entries = max_entries
+        self._dimension = self.encoder.get_sentence_embedding_dimension()
+        # One index per namespace, so only prompts built from the same template compete
+        self._indexes: Dict[str, Any] = {}
+        # Entries per namespace by index id, oldest first
+        self._store: Dict[str, OrderedDict[int, Tuple[str, float]]] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def _embed(self, text: str):
+        """Embed text as a normalized vector, so inner product is cosine similarity"""
+        return self.encoder.encode([text], normalize_embeddings=True).astype("float32")
+
+    def lookup(self, text: str, namespace: str = "") -> Optional[str]:
+        """Return the cached response for the most similar unexpired prompt"""
+        vector = self._embed(text)
+        with self._lock:
+            index = self._indexes.get(namespace)
+            if index is None or index.ntotal == 0:
+                return None
+            scores, ids = index.search(vector, min(self.max_candidates, index.ntotal))
+            now = time.monotonic()
+            for score, idx in zip(scores[0], ids[0]):
+                if idx < 0 or score < self.similarity_threshold:
+                    break
+                entry = self._store[namespace].get(int(idx))
+                if entry is None:
+                    continue
+                response, created_at = entry
+                if self.ttl is None or now - created_at <= self.ttl:
+                    return response
+        return None
+
+    def update(self, text: str, response: str, namespace: str = ""):
+        """Add a prompt and its response to the cache"""
+        vector = self._embed(text)
+        with self._lock:
+            index = self._indexes.get(namespace)
+            if index is None:
+                index = self._indexes[namespace] = faiss.IndexIDMap(
+                    faiss.IndexFlatIP(self._dimension)
+                )
+                self._store[namespace] = OrderedDict()
+            now = time.monotonic()
+            index.add_with_ids(vector, np.array([self._next_id], dtype="int64"))
+            self._store[namespace][self._next_id] = (response, now)
+            self._next_id += 1
+            self._evict(namespace, now)
+
+    def _evict(self, namespace: str, now: float):
+        """Drop expired entries and the oldest ones beyond max_entries"""
+        store = self._store[namespace]
+        stale = []
+        # Entries are in insertion order, so expired ones are at the front
+        for entry_id, (_, created_at) in store.items():
+            if self.ttl is not None and now - created_at > self.ttl:
+                stale.append(entry_id)
+            else:
+                break
+        if self.max_entries is not None:
+            excess = len(store) - len(stale) - self.max_entries
+            stale.extend(list(store)[len(stale) : len(stale) + max(excess, 0)])
+        if stale:
+            self._indexes[namespace].remove_ids(np.array(stale, dtype="int64"))
+            for entry_id in stale:
+                del store[entry_id]
@@ -1,10 +1,56 @@
 import asyncio
 import json
+from collections import defaultdict
 from dataclasses import dataclass
 from enum import Enum
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 
-from augmented_llm import AugmentedLLM
+from augmented_llm import AugmentedLLM, cached_prompt, strip_code_fence, task_group
+
+# uvloop is optional; it runs the examples on a faster event loop
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+# orjson is optional; it parses large plans faster
+try:
+    import orjson
+
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+
+# Prompt instructions are kept byte-identical across calls and sent first,
+# so the provider prefix cache can reuse them; the per-call content follows.
+PLANNING_PROMPT_PREFIX = """Break down the task given at the end into smaller subtasks.
+
+Return the subtasks in JSON format with the following structure:
+{
+    "subtasks": [
+        {
+            "id": "unique_id",
+            "description": "subtask description",
+            "dependencies": ["dependent_task_ids"]
+        }
+    ]
+}
+
+Ensure tasks are properly ordered with dependencies.
+
+"""
+
+EXECUTION_PROMPT_PREFIX = """Execute the task given at the end.
+If this task depends on other tasks, their results are listed before it.
+
+"""
+
+SYNTHESIS_PROMPT_PREFIX = """Synthesize the results of all subtasks into a coherent final output.
+
+Each subtask's result is given in a <task> element below.
+
+"""
 
 
 class TaskStatus(Enum):
@@ -26,49 +72,43 @@ class SubTask:
 
 # The Orchestrator
 class OrchestratorAgent:
-    def __init__(self, llm: AugmentedLLM):
+    def __init__(
+        self,
+        llm: AugmentedLLM,
+        max_tokens: int = 1000,
+        synthesis_max_tokens: int = 2048,
+    ):
         self.llm = llm
+        # Output budgets for planning and subtasks, and for the final report
+        self.max_tokens = max_tokens
+        self.synthesis_max_tokens = synthesis_max_tokens
         self.tasks: Dict[str, SubTask] = {}
 
-    def plan_subtasks(self, main_task: str) -> List[SubTask]:
+    async def plan_subtasks(self, main_task: str) -> List[SubTask]:
         """Use LLM to break down the main task into subtasks"""
-        planning_prompt = f"""
-        Break down the following task into smaller subtasks:
-        {main_task}
-        
-        Return the subtasks in JSON format with the following structure:
-        {{
-            "subtasks": [
-                {{
-                    "id": "unique_id",
-                    "description": "subtask description",
-                    "dependencies": ["dependent_task_ids"]
-                }}
-            ]
-        }}
-        
-        Ensure tasks are properly ordered with dependencies.
-        """
+        planning_prompt = cached_prompt(
+            PLANNING_PROMPT_PREFIX, f"Task:\n{main_task}"
+        )
 
-        response = self.llm.call(planning_prompt)
+        response = await self.llm.acall(planning_prompt, max_tokens=self.max_tokens)
         try:
-            plan = json.loads(response)
+            plan = json_loads(strip_code_fence(response))
             return [SubTask(**task) for task in plan["subtasks"]]
         except json.JSONDecodeError:
             raise ValueError("Failed to parse LLM response as JSON")
 
     async def execute_subtask(self, task: SubTask) -> str:
         """Execute a single subtask using a worker LLM"""
-        execution_prompt = f"""
-        Execute the following task:
-        {task.description}
-        
-        If this task depends on other tasks, here are their results:
-        {self._get_dependency_results(task)}
-        """
+        execution_prompt = cached_prompt(
+            EXECUTION_PROMPT_PREFIX,
+            f"Dependency results:\n{self._get_dependency_results(task)}\n\n"
+            f"Task:\n{task.description}",
+        )
 
         try:
-            result = self.llm.call(execution_prompt)
+            result = await self.llm.acall(
+                execution_prompt, max_tokens=self.max_tokens
+            )
             return result
         except Exception as e:
             task.status = TaskStatus.FAILED
@@ -83,67 +123,78 @@ class OrchestratorAgent:
                 dependency_results.append(f"{dep_id}: {dep_task.result}")
         return "\n".join(dependency_results)
 
-    def synthesize_results(self, results: Dict[str, str]) -> str:
+    async def synthesize_results(self, results: Dict[str, str]) -> str:
         """Use LLM to synthesize all results into final output"""
-        synthesis_prompt = f"""
-        Synthesize the results of all subtasks into a coherent final output:
-        
-        Results:
-        {json.dumps(results, indent=2)}
+        # Plain tagged text rather than JSON, so results are not escaped and re-quoted
+        tagged_results = "\n".join(
+            f'<task id="{task_id}">\n{result}\n</task>'
+            for task_id, result in results.items()
+        )
+        synthesis_prompt = cached_prompt(
+            SYNTHESIS_PROMPT_PREFIX, f"Results:\n{tagged_results}"
+        )
+
+        return await self.llm.acall(
+            synthesis_prompt, max_tokens=self.synthesis_max_tokens
+        )
+
+    def _build_dependency_index(
+        self, subtasks: List[SubTask]
+    ) -> Tuple[Dict[str, int], Dict[str, List[str]]]:
+        """Count each subtask's unfinished dependencies and map each to its dependants
+
+        Built once per plan, so scheduling does no per-round scan of the plan.
         """
-
-        return self.llm.call(synthesis_prompt)
+        remaining = {task.id: len(task.dependencies) for task in subtasks}
+        children: Dict[str, List[str]] = defaultdict(list)
+        for task in subtasks:
+            for dep_id in task.dependencies:
+                if dep_id not in remaining:
+                    raise ValueError(
+                        f"Task {task.id} depends on unknown task {dep_id}"
+                    )
+                children[dep_id].append(task.id)
+        return remaining, children
 
     async def execute_task(self, main_task: str) -> str:
         """Execute the main task using orchestrator-workers pattern"""
         # Plan subtasks
-        subtasks = self.plan_subtasks(main_task)
+        subtasks = await self.plan_subtasks(main_task)
         for task in subtasks:
             self.tasks[task.id] = task
 
-        # Execute tasks respecting dependencies
+        remaining, children = self._build_dependency_index(subtasks)
+
+        # Execute tasks respecting dependencies, starting each one as soon as
+        # its own dependencies complete instead of waiting for a whole level
         results = {}
-        while any(task.status != TaskStatus.COMPLETED for task in self.tasks.values()):
-            # Find tasks ready to execute (all dependencies completed)
-            ready_tasks = [
-                task
-                for task in self.tasks.values()
-                if task.status == TaskStatus.PENDING
-                and all(
-                    self.tasks[dep_id].status == TaskStatus.COMPLETED
-                    for dep_id in task.dependencies
-                )
-            ]
-
-            if not ready_tasks:
-                # Check for failed tasks
-                if any(
-                    task.status == TaskStatus.FAILED for task in self.tasks.values()
-                ):
-                    raise Exception("Task execution failed")
-                # If no tasks are ready but some are still pending, we have a dependency cycle
-                if any(
-                    task.status == TaskStatus.PENDING for task in self.tasks.values()
-                ):
-                    raise Exception("Dependency cycle detected")
-                break
-
-            # Execute ready tasks in parallel
-            tasks = []
-            for task in ready_tasks:
-                task.status = TaskStatus.IN_PROGRESS
-                tasks.append(self.execute_subtask(task))
-
-            task_results = await asyncio.gather(*tasks)
-
-            # Store results
-            for task, result in zip(ready_tasks, task_results):
-                task.status = TaskStatus.COMPLETED
-                task.result = result
-                results[task.id] = result
+
+        async def run(task: SubTask):
+            task.result = await self.execute_subtask(task)
+            task.status = TaskStatus.COMPLETED
+            results[task.id] = task.result
+
+            # Start any dependants that were only waiting on this task
+            for child_id in children[task.id]:
+                remaining[child_id] -= 1
+                if remaining[child_id] == 0:
+                    start(self.tasks[child_id])
+
+        def start(task: SubTask):
+            task.status = TaskStatus.IN_PROGRESS
+            group.create_task(run(task))
+
+        async with task_group() as group:
+            for task in subtasks:
+                if remaining[task.id] == 0:
+                    start(task)
+
+        # If tasks are still pending once nothing is running, we have a dependency cycle
+        if any(task.status == TaskStatus.PENDING for task in subtasks):
+            raise Exception("Dependency cycle detected")
 
         # Synthesize results
-        return self.synthesize_results(results)
+        return await self.synthesize_results(results)
 
 
 # Example usage: Complex code change
@@ -185,13 +236,24 @@ async def run_search_analysis_example(llm: AugmentedLLM):
         return None
 
 
-# Run our examples
-if __name__ == "__main__":
+async def main():
     # Initialize augmented LLM
     llm = AugmentedLLM("your-api-key")
 
-    code_change_results = asyncio.run(run_code_change_example(llm=llm))
-    print("Code change results:", code_change_results)
+    # Run both examples on one event loop so they share the connection pool
+    try:
+        code_change_results = await run_code_change_example(llm=llm)
+        print("Code change results:", code_change_results)
+
+        search_analysis_results = await run_search_analysis_example(llm=llm)
+        print("Search analysis results:", search_analysis_results)
+    finally:
+        await llm.aclose()
 
-    search_analysis_results = asyncio.run(run_search_analysis_example(llm=llm))
-    print("Search analysis results:", search_analysis_results)
+
+# Run our examples
+if __name__ == "__main__":
+    if uvloop is not None:
+        uvloop.run(main())
+    else:
+        asyncio.run(main())
@@ -1,10 +1,15 @@
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from enum import Enum
-from typing import Any, Callable, Dict, List, Optional
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Set, Tuple
 
-from augmented_llm import AugmentedLLM
+from augmented_llm import AugmentedLLM, task_group
+
+# uvloop is optional; it runs the examples on a faster event loop
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
 
 
 class ParallelizationType(Enum):
@@ -17,38 +22,129 @@ class ParallelTask:
     name: str
     prompt: str
     aggregation_func: Optional[Callable] = None
+    # Voting only: given the votes so far and the total number of votes,
+    # return None to keep voting or any other value once the outcome can no
+    # longer change
+    early_decision: Optional[Callable[[List[str], int], Optional[Any]]] = None
 
 
 class ParallelProcessor:
-    def __init__(self, llm: AugmentedLLM, parallel_type: ParallelizationType):
+    def __init__(
+        self,
+        llm: AugmentedLLM,
+        parallel_type: ParallelizationType,
+        max_batch_size: int = 8,
+        batch_window: float = 0.25,
+        max_tokens: int = 1000,
+        vote_max_tokens: int = 16,
+    ):
         self.llm = llm
         self.parallel_type = parallel_type
-        self.executor = ThreadPoolExecutor(max_workers=5)
+        # Output budgets per section and per vote; votes are short labels
+        self.max_tokens = max_tokens
+        self.vote_max_tokens = vote_max_tokens
+        # Prompts submitted within batch_window of each other share one request
+        self.max_batch_size = max_batch_size
+        self.batch_window = batch_window
+        self._queue: asyncio.Queue[Tuple[str, asyncio.Future]] = asyncio.Queue()
+        self._batcher: Optional[asyncio.Task] = None
+        self._dispatches: Set[asyncio.Task] = set()
+
+    async def _submit(self, prompt: str) -> str:
+        """Queue a prompt for the next batch and wait for its response"""
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((prompt, future))
+        if self._batcher is None or self._batcher.done():
+            self._batcher = asyncio.create_task(self._collect_batches())
+        return await future
+
+    async def _collect_batches(self):
+        """Drain the queue into batches of up to max_batch_size prompts"""
+        loop = asyncio.get_running_loop()
+        while not self._queue.empty():
+            batch = [self._queue.get_nowait()]
+            # The window runs from the first prompt, so none waits longer than it
+            deadline = loop.time() + self.batch_window
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(
+                        await asyncio.wait_for(self._queue.get(), timeout=remaining)
+                    )
+                except asyncio.TimeoutError:
+                    break
+
+            # Dispatch without waiting, so the next batch can start filling
+            dispatch = asyncio.create_task(self._dispatch_batch(batch))
+            self._dispatches.add(dispatch)
+            dispatch.add_done_callback(self._dispatches.discard)
+
+    async def _dispatch_batch(self, batch: List[Tuple[str, asyncio.Future]]):
+        """Send a batch of prompts as one request and resolve their futures"""
+        try:
+            responses = await self.llm.acall_batched(
+                [prompt for prompt, _ in batch], max_tokens=self.max_tokens
+            )
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), response in zip(batch, responses):
+            if not future.done():
+                future.set_result(response)
 
     async def process_section(self, task: ParallelTask) -> Dict[str, Any]:
         """Process a single section"""
-        response = await asyncio.get_event_loop().run_in_executor(
-            self.executor, self.llm.call, task.prompt
-        )
+        response = await self._submit(task.prompt)
         return {"task": task.name, "response": response}
 
     async def process_vote(
         self, task: ParallelTask, num_votes: int = 3
     ) -> Dict[str, Any]:
         """Process multiple votes for the same task"""
-        tasks = []
-        for i in range(num_votes):
-            tasks.append(self.process_section(task))
-
-        responses = await asyncio.gather(*tasks)
-        return {"task": task.name, "votes": [r["response"] for r in responses]}
+        # Each vote needs an independent sample, so votes are separate requests
+        # that bypass the response cache and in-flight deduplication; with an
+        # early_decision, the rest are cancelled once the outcome is decided
+        votes = []
+        async with task_group() as group:
+            pending = [
+                group.create_task(
+                    self.llm.acall(
+                        task.prompt,
+                        use_cache=False,
+                        max_tokens=self.vote_max_tokens,
+                        dedupe=False,
+                    )
+                )
+                for _ in range(num_votes)
+            ]
+            for next_vote in asyncio.as_completed(pending):
+                votes.append(await next_vote)
+                if task.early_decision is None:
+                    continue
+                if task.early_decision(votes, num_votes) is not None:
+                    for vote in pending:
+                        vote.cancel()
+                    break
+        return {"task": task.name, "votes": votes}
+
+    async def _run_all(self, coros: List[Coroutine]) -> List[Any]:
+        """Run coroutines concurrently and return their results in order"""
+        async with task_group() as group:
+            running = [group.create_task(coro) for coro in coros]
+        return [task.result() for task in running]
 
     async def process_tasks(self, tasks: List[ParallelTask]) -> Dict[str, Any]:
         """Process multiple tasks in parallel"""
         if self.parallel_type == ParallelizationType.SECTIONING:
             # Run all sections in parallel
-            section_tasks = [self.process_section(task) for task in tasks]
-            results = await asyncio.gather(*section_tasks)
+            results = await self._run_all(
+                [self.process_section(task) for task in tasks]
+            )
 
             # Aggregate results if specified
             if any(task.aggregation_func for task in tasks):
@@ -66,8 +162,7 @@ class ParallelProcessor:
 
         else:  # VOTING
             # Run voting for each task
-            vote_tasks = [self.process_vote(task) for task in tasks]
-            results = await asyncio.gather(*vote_tasks)
+            results = await self._run_all([self.process_vote(task) for task in tasks])
 
             # Aggregate votes if specified
             aggregated_results = {}
@@ -85,10 +180,27 @@ class ParallelProcessor:
 
 
 # Example usage: Content moderation with parallel checks
+INAPPROPRIATE_VOTE_THRESHOLD = 2  # At least 2 votes needed to flag content
+
+
+def _count_inappropriate(votes: List[str]) -> int:
+    """Count the votes that flag the content as inappropriate"""
+    return sum(1 for vote in votes if "inappropriate" in vote.lower())
+
+
 def check_inappropriate_content(votes: List[str]) -> bool:
     """Aggregate votes to determine if content is inappropriate"""
-    yes_votes = sum(1 for vote in votes if "inappropriate" in vote.lower())
-    return yes_votes >= 2  # At least 2 votes needed to flag content
+    return _count_inappropriate(votes) >= INAPPROPRIATE_VOTE_THRESHOLD
+
+
+def decide_inappropriate_content(votes: List[str], num_votes: int) -> Optional[bool]:
+    """Decide once the remaining votes cannot change the outcome, else return None"""
+    yes_votes = _count_inappropriate(votes)
+    if yes_votes >= INAPPROPRIATE_VOTE_THRESHOLD:
+        return True
+    if yes_votes + num_votes - len(votes) < INAPPROPRIATE_VOTE_THRESHOLD:
+        return False
+    return None
 
 
 async def run_content_moderation_example(llm: AugmentedLLM):
@@ -100,6 +212,7 @@ async def run_content_moderation_example(llm: AugmentedLLM):
         name="content_check",
         prompt="Is the following content inappropriate? Answer only 'appropriate' or 'inappropriate': {content}",
         aggregation_func=check_inappropriate_content,
+        early_decision=decide_inappropriate_content,
     )
 
     # Run parallel votes
@@ -142,13 +255,24 @@ async def run_document_analysis_example(llm: AugmentedLLM):
     return results
 
 
-# Run examples
-if __name__ == "__main__":
+async def main():
     # Initialize augmented LLM
     llm = AugmentedLLM("your-api-key")
 
-    content_moderation_results = asyncio.run(run_content_moderation_example(llm=llm))
-    print("Content moderation results:", content_moderation_results)
+    # Run both examples on one event loop so they share the connection pool
+    try:
+        content_moderation_results = await run_content_moderation_example(llm=llm)
+        print("Content moderation results:", content_moderation_results)
 
-    document_analysis_results = asyncio.run(run_document_analysis_example(llm=llm))
-    print("Document analysis results:", document_analysis_results)
+        document_analysis_results = await run_document_analysis_example(llm=llm)
+        print("Document analysis results:", document_analysis_results)
+    finally:
+        await llm.aclose()
+
+
+# Run examples
+if __name__ == "__main__":
+    if uvloop is not None:
+        uvloop.run(main())
+    else:
+        asyncio.run(main())
@@ -1,7 +1,9 @@
-from dataclasses import dataclass
+from contextlib import aclosing
+from dataclasses import dataclass, field
+from string import Formatter
 from typing import Callable, List, Optional
 
-from augmented_llm import AugmentedLLM
+from augmented_llm import AugmentedLLM, Prompt
 
 
 @dataclass
@@ -9,6 +11,46 @@ class ChainStep:
     name: str
     prompt_template: str
     validation_func: Optional[Callable[[str], bool]] = None
+    # Checked against each new piece of the response while streaming, together
+    # with the last partial_validation_overlap characters before it so matches
+    # spanning two pieces are seen; returning False rejects the step without
+    # waiting for the rest of the generation
+    partial_validation_func: Optional[Callable[[str], bool]] = None
+    partial_validation_overlap: int = 32
+    # Output budget for this step's LLM call
+    max_tokens: int = 512
+    _prefix: str = field(init=False, repr=False)
+    _suffix: Optional[str] = field(init=False, repr=False)
+
+    def __post_init__(self):
+        # Pre-split templates with a single {input} placeholder, so each call is
+        # a plain concatenation and the text before the input is byte-identical
+        parts = list(Formatter().parse(self.prompt_template))
+        fields = [i for i, (_, name, _, _) in enumerate(parts) if name is not None]
+        if len(fields) == 1 and parts[fields[0]][1:] == ("input", "", None):
+            split = fields[0] + 1
+            self._prefix = "".join(literal for literal, *_ in parts[:split])
+            self._suffix = "".join(literal for literal, *_ in parts[split:])
+        else:
+            self._prefix, self._suffix = "", None
+
+    def render(self, input_text: str) -> Prompt:
+        """Build this step's prompt from the previous step's output"""
+        if self._suffix is None:
+            # Other templates still need full formatting
+            return self.prompt_template.format(input=input_text)
+
+        # Cache breakpoints after both the instructions and the previous
+        # step's output, so a re-run of the chain reuses the provider cache
+        # up to the first step whose output differs
+        blocks = [
+            {"type": "text", "text": text, "cache_control": {"type": "ephemeral"}}
+            for text in (self._prefix, input_text)
+            if text
+        ]
+        if self._suffix:
+            blocks.append({"type": "text", "text": self._suffix})
+        return blocks
 
 
 class PromptChain:
@@ -27,10 +69,10 @@ class PromptChain:
 
         for step in self.steps:
             # Format prompt with previous input
-            prompt = step.prompt_template.format(input=current_input)
+            prompt = step.render(current_input)
 
             # Execute LLM call
-            response = self.llm.call(prompt)
+            response = self.llm.call(prompt, max_tokens=step.max_tokens)
 
             # Validate if needed
             if step.validation_func and not step.validation_func(response):
@@ -46,26 +88,75 @@ class PromptChain:
 
         return results
 
+    async def execute_streaming(self, initial_input: str) -> List[dict]:
+        """Execute the full chain, streaming each step to fail fast"""
+        results = []
+        current_input = initial_input
+
+        for step in self.steps:
+            prompt = step.render(current_input)
+
+            # Stream the response, rejecting it as soon as a partial check fails;
+            # closing the stream cancels the rest of the generation. Only new
+            # text and a short overlap are checked, so each delta costs the same
+            chunks = []
+            tail = ""
+            async with aclosing(
+                self.llm.astream_call(prompt, max_tokens=step.max_tokens)
+            ) as stream:
+                async for text in stream:
+                    chunks.append(text)
+                    if not step.partial_validation_func:
+                        continue
+                    window = tail + text
+                    if not step.partial_validation_func(window):
+                        raise ValueError(f"Validation failed for step: {step.name}")
+                    overlap = step.partial_validation_overlap
+                    tail = window[-overlap:] if overlap else ""
+            response = "".join(chunks)
+
+            # Validate the complete response if needed
+            if step.validation_func and not step.validation_func(response):
+                raise ValueError(f"Validation failed for step: {step.name}")
+
+            # Store results
+            results.append(
+                {"step": step.name, "input": current_input, "output": response}
+            )
+
+            # Update input for next step
+            current_input = response
+
+        return results
+
 
 # Example usage: Marketing copy generation and translation
+def has_no_banned_words(text: str) -> bool:
+    """Check marketing copy is free of banned words; also valid on partial text"""
+    return not any(
+        banned_word in text.lower() for banned_word in ["spam", "guarantee"]
+    )
+
+
 def validate_marketing_copy(text: str) -> bool:
     """Validate marketing copy meets requirements"""
     # Add your validation logic here
-    return len(text) >= 100 and not any(
-        banned_word in text.lower() for banned_word in ["spam", "guarantee"]
-    )
+    return len(text) >= 100 and has_no_banned_words(text)
 
 
 # Create chain steps
 marketing_step = ChainStep(
     name="generate_marketing",
-    prompt_template="Create marketing copy for the following product: {input}",
+    prompt_template="Create marketing copy for the product given at the end.\n\n{input}",
     validation_func=validate_marketing_copy,
+    partial_validation_func=has_no_banned_words,
 )
 
 translation_step = ChainStep(
     name="translate",
-    prompt_template="Translate the following marketing copy to Spanish: {input}",
+    prompt_template="Translate the marketing copy given at the end to Spanish.\n\n{input}",
+    # Spanish usually runs longer than the English copy it is translated from
+    max_tokens=1024,
 )
 
 # Example usage
@@ -1,7 +1,27 @@
+import threading
+from collections import OrderedDict
+from contextlib import aclosing
 from enum import Enum
-from typing import Callable, Dict
+from typing import Callable, Dict, Optional
 
-from augmented_llm import AugmentedLLM
+from augmented_llm import AugmentedLLM, cached_prompt
+
+# Sent byte-identical on every call so the provider prefix cache can reuse it
+CLASSIFICATION_PROMPT_PREFIX = """Classify the customer query given at the end into one of these categories:
+- GENERAL: General product questions
+- TECHNICAL: Technical support issues
+- REFUND: Refund requests
+- UNKNOWN: Cannot be classified
+
+Respond with only the category name.
+
+"""
+
+# Classification answers are a single word, so a tiny output budget suffices
+CLASSIFICATION_MAX_TOKENS = 8
+
+# Number of distinct queries whose classification is remembered
+CLASSIFICATION_CACHE_SIZE = 10_000
 
 
 class QueryType(Enum):
@@ -11,34 +31,97 @@ class QueryType(Enum):
     UNKNOWN = "unknown"
 
 
+# Lowercase category names mapped to their query type
+_LABEL_MAP = {query_type.value: query_type for query_type in QueryType}
+
+
 class Router:
     def __init__(self, llm: AugmentedLLM):
         self.llm = llm
         self.handlers: Dict[QueryType, Callable] = {}
+        # LRU memo of classifications by exact query, shared by the sync and
+        # async paths, so repeat queries skip the LLM call entirely
+        self._classifications: OrderedDict[str, QueryType] = OrderedDict()
+        self._classifications_lock = threading.Lock()
 
     def register_handler(self, query_type: QueryType, handler: Callable):
         """Register a handler for a specific query type"""
         self.handlers[query_type] = handler
 
+    def _recall_classification(self, query: str) -> Optional[QueryType]:
+        """Return the remembered classification for a query, if any"""
+        with self._classifications_lock:
+            query_type = self._classifications.get(query)
+            if query_type is not None:
+                self._classifications.move_to_end(query)
+            return query_type
+
+    def _remember_classification(self, query: str, query_type: QueryType):
+        """Remember a classification, evicting the least recently used if full"""
+        with self._classifications_lock:
+            self._classifications[query] = query_type
+            if len(self._classifications) > CLASSIFICATION_CACHE_SIZE:
+                self._classifications.popitem(last=False)
+
     def classify_query(self, query: str) -> QueryType:
         """Use LLM to classify the query type"""
-        classification_prompt = f"""
-        Classify the following customer query into one of these categories:
-        - GENERAL: General product questions
-        - TECHNICAL: Technical support issues
-        - REFUND: Refund requests
-        - UNKNOWN: Cannot be classified
-        
-        Query: {query}
-        
-        Respond with only the category name.
-        """
-
-        response = self.llm.call(classification_prompt).strip().upper()
-        try:
-            return QueryType[response]
-        except KeyError:
+        query_type = self._recall_classification(query)
+        if query_type is not None:
+            return query_type
+
+        classification_prompt = cached_prompt(
+            CLASSIFICATION_PROMPT_PREFIX, f"Query:\n{query}"
+        )
+
+        # The label space is tiny and deterministic, so paraphrased queries can
+        # safely reuse an earlier classification
+        response = self.llm.call(
+            classification_prompt,
+            use_semantic_cache=True,
+            max_tokens=CLASSIFICATION_MAX_TOKENS,
+        )
+        query_type = self._parse_query_type(response)
+        self._remember_classification(query, query_type)
+        return query_type
+
+    async def aclassify_query(self, query: str) -> QueryType:
+        """Use LLM to classify the query type, stopping once the label is read"""
+        query_type = self._recall_classification(query)
+        if query_type is not None:
+            return query_type
+
+        classification_prompt = cached_prompt(
+            CLASSIFICATION_PROMPT_PREFIX, f"Query:\n{query}"
+        )
+
+        # Paraphrased queries reuse an earlier classification, as in
+        # classify_query; otherwise only the category name matters, so close
+        # the stream (cancelling the rest of the generation) as soon as the
+        # first word is complete
+        response = ""
+        async with aclosing(
+            self.llm.astream_call(
+                classification_prompt,
+                use_semantic_cache=True,
+                max_tokens=CLASSIFICATION_MAX_TOKENS,
+            )
+        ) as stream:
+            async for text in stream:
+                response += text
+                if any(char.isspace() for char in response.lstrip()):
+                    break
+        query_type = self._parse_query_type(response)
+        self._remember_classification(query, query_type)
+        return query_type
+
+    @staticmethod
+    def _parse_query_type(response: str) -> QueryType:
+        """Map the first word of the LLM's answer to a query type"""
+        # Tolerates verbose answers such as "TECHNICAL." or "Technical support issue"
+        words = response.split(maxsplit=1)
+        if not words:
             return QueryType.UNKNOWN
+        return _LABEL_MAP.get(words[0].strip(".:,").lower(), QueryType.UNKNOWN)
 
     def route_and_handle(self, query: str) -> str:
         """Classify query and route to appropriate handler"""